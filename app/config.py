@@ -24,6 +24,7 @@ class Settings:
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "info")
 
     # Paths
+    PROVISION_LOG_DIR: str = os.getenv("PROVISION_LOG_DIR", "/var/log/openclaw/provision")
     PROVISIONING_SCRIPT: str = os.path.join(
         os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
         "provisioning.sh",
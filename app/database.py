@@ -1,7 +1,12 @@
 """SQLite database setup and helpers."""
 
-import aiosqlite
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import aiosqlite
 
 DB_PATH = os.getenv("DB_PATH", "openclaw_hosted.db")
 
@@ -28,11 +33,17 @@ CREATE TABLE IF NOT EXISTS instances (
     status TEXT NOT NULL DEFAULT 'provisioning',
     health_status TEXT DEFAULT 'unknown',
     last_health_check TEXT,
-    provision_log TEXT,
     created_at TEXT NOT NULL DEFAULT (datetime('now')),
     updated_at TEXT NOT NULL DEFAULT (datetime('now'))
 );
 
+-- Kept out of `instances` so hot reads there don't page the log text in
+CREATE TABLE IF NOT EXISTS instance_logs (
+    instance_id TEXT PRIMARY KEY REFERENCES instances(id),
+    log TEXT,
+    updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
 CREATE TABLE IF NOT EXISTS events (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     instance_id TEXT REFERENCES instances(id),
@@ -41,23 +52,227 @@ CREATE TABLE IF NOT EXISTS events (
     payload TEXT,
     created_at TEXT NOT NULL DEFAULT (datetime('now'))
 );
+
+-- customers.paddle_subscription_id is already indexed by its UNIQUE constraint
+CREATE INDEX IF NOT EXISTS idx_instances_created ON instances(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_instances_status_created ON instances(status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_instances_active_ip ON instances(status)
+    WHERE status = 'active' AND server_ip IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_instances_customer ON instances(customer_id);
+"""
+
+
+# Applied once per pooled connection. synchronous=NORMAL is durable enough under
+# WAL (only the last commits can be lost on power failure, never corruption).
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=5000;
+PRAGMA temp_store=memory;
+PRAGMA cache_size=-64000;
+PRAGMA foreign_keys=ON;
+PRAGMA mmap_size=268435456;
+"""
+
+
+_COUNT_INSTANCES = "SELECT COUNT(*) FROM instances"
+_COUNT_INSTANCES_BY_STATUS = "SELECT COUNT(*) FROM instances WHERE status = ?1"
+
+# {total} is an uncorrelated COUNT subquery: SQLite runs it once per statement,
+# and unlike COUNT(*) OVER () it doesn't force the whole join to be built and
+# sorted, so the ORDER BY/LIMIT below can walk the created_at indexes.
+_INSTANCE_LIST_COLUMNS = """
+    SELECT i.id as instance_id, i.customer_id, c.email as customer_email,
+           i.status, i.server_ip, i.hetzner_server_id,
+           i.setup_password, c.plan, i.created_at,
+           i.health_status, i.last_health_check,
+           ({total}) AS total
+    FROM instances i
+    JOIN customers c ON i.customer_id = c.id
 """
 
 
-async def get_db() -> aiosqlite.Connection:
-    """Get a database connection. Caller must close it."""
-    db = await aiosqlite.connect(DB_PATH)
+@dataclass(frozen=True)
+class Statements:
+    """
+    Every SQL statement the app runs, in one place. Each is a fixed string
+    (values are always bound, never formatted in), so sqlite3's per-connection
+    statement cache, which matches on SQL text, keeps each one prepared.
+    """
+
+    begin_immediate: str = "BEGIN IMMEDIATE"
+
+    # customers
+    insert_customer: str = """INSERT INTO customers (id, email, name, paddle_subscription_id, paddle_customer_id, plan, status)
+        VALUES (?, ?, ?, ?, ?, ?, 'pending')"""
+    insert_customer_if_new: str = """INSERT INTO customers (id, email, name, paddle_subscription_id, paddle_customer_id, plan, status)
+        VALUES (?, ?, ?, ?, ?, ?, 'pending')
+        ON CONFLICT(paddle_subscription_id) DO NOTHING
+        RETURNING id"""
+    select_customer_by_sub: str = "SELECT id FROM customers WHERE paddle_subscription_id = ?"
+    update_customer_active: str = "UPDATE customers SET status = 'active', updated_at = datetime('now') WHERE id = ?"
+    update_customer_canceled: str = (
+        "UPDATE customers SET status = 'canceled', updated_at = datetime('now') WHERE paddle_subscription_id = ?"
+    )
+
+    # instances
+    insert_instance: str = "INSERT INTO instances (id, customer_id, status) VALUES (?, ?, 'provisioning')"
+    # Every row carries the full total (taken before LIMIT/OFFSET).
+    # Filtered and unfiltered listings are separate statements: a single
+    # "(?1 IS NULL OR status = ?1)" form gets one plan for both cases, which walks
+    # idx_instances_created across every status instead of seeking into
+    # idx_instances_status_created when a status is given.
+    list_instances: str = (
+        _INSTANCE_LIST_COLUMNS.format(total=_COUNT_INSTANCES)
+        + " ORDER BY i.created_at DESC LIMIT ? OFFSET ?"
+    )
+    # Numbered parameters let the count reuse the status binding: (status, limit, offset)
+    list_instances_by_status: str = (
+        _INSTANCE_LIST_COLUMNS.format(total=_COUNT_INSTANCES_BY_STATUS)
+        + " WHERE i.status = ?1 ORDER BY i.created_at DESC LIMIT ?2 OFFSET ?3"
+    )
+    # Only needed when the page is past the end and no row carries the total
+    count_instances: str = _COUNT_INSTANCES
+    count_instances_by_status: str = _COUNT_INSTANCES_BY_STATUS
+    select_instance_health: str = (
+        "SELECT id, server_ip, health_status, last_health_check, status FROM instances WHERE id = ?"
+    )
+    select_instance_server: str = "SELECT hetzner_server_id, status FROM instances WHERE id = ?"
+    # Bound with a JSON array of ids so one fixed statement serves any batch size
+    select_instances_servers: str = (
+        "SELECT id, hetzner_server_id FROM instances WHERE id IN (SELECT value FROM json_each(?))"
+    )
+    select_active_instances: str = (
+        "SELECT id, server_ip FROM instances WHERE status = 'active' AND server_ip IS NOT NULL"
+    )
+    update_instance_status: str = "UPDATE instances SET status = ?, updated_at = datetime('now') WHERE id = ?"
+    update_setup_password: str = (
+        "UPDATE instances SET setup_password = ?, updated_at = datetime('now') WHERE id = ?"
+    )
+    update_instance_provisioned: str = """UPDATE instances SET
+            status = 'active',
+            hetzner_server_id = ?,
+            server_ip = ?,
+            server_name = ?,
+            setup_password = ?,
+            health_status = 'healthy',
+            last_health_check = datetime('now'),
+            updated_at = datetime('now')
+        WHERE id = ?"""
+    update_instance_failed: str = """UPDATE instances SET
+            status = 'failed',
+            updated_at = datetime('now')
+        WHERE id = ?"""
+    update_instance_health: str = """UPDATE instances SET
+            health_status = ?,
+            last_health_check = datetime('now'),
+            updated_at = datetime('now')
+        WHERE id = ?"""
+
+    # instance_logs
+    upsert_instance_log: str = """INSERT INTO instance_logs (instance_id, log) VALUES (?, ?)
+        ON CONFLICT(instance_id) DO UPDATE SET log = excluded.log, updated_at = datetime('now')"""
+
+    # events
+    insert_event: str = "INSERT INTO events (instance_id, customer_id, event_type, payload) VALUES (?, ?, ?, ?)"
+    insert_event_by_sub: str = (
+        "INSERT INTO events (customer_id, event_type, payload) "
+        "VALUES ((SELECT id FROM customers WHERE paddle_subscription_id = ?), ?, ?)"
+    )
+
+
+SQL = Statements()
+
+
+async def _connect(database: str, read_only: bool = False, **kwargs) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(database, **kwargs)
     db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
-    await db.execute("PRAGMA foreign_keys=ON")
+    pragmas = PRAGMAS + "PRAGMA query_only=ON;\n" if read_only else PRAGMAS
+    await db.executescript(pragmas)
     return db
 
 
+class WriterPool:
+    """The single read-write connection. Only one transaction can hold it at a time."""
+
+    def __init__(self):
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Semaphore(1)
+
+    async def open(self):
+        self._lock = asyncio.Semaphore(1)
+        self._db = await _connect(DB_PATH)
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._lock:
+            try:
+                yield self._db
+            except BaseException:
+                # Don't leak a half-finished transaction to the next writer
+                await self._db.rollback()
+                raise
+
+
+class ReaderPool:
+    """Read-only connections; under WAL these don't block on (or block) the writer."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all: list[aiosqlite.Connection] = []
+
+    async def open(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            db = await _connect(f"file:{DB_PATH}?mode=ro", read_only=True, uri=True)
+            self._all.append(db)
+            self._idle.put_nowait(db)
+
+    async def close(self):
+        for db in self._all:
+            await db.close()
+        self._all.clear()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        db = await self._idle.get()
+        try:
+            yield db
+        finally:
+            self._idle.put_nowait(db)
+
+
+writer = WriterPool()
+readers = ReaderPool(size=os.cpu_count() or 4)
+
+
+def acquire_read():
+    """Borrow a read-only connection for SELECTs."""
+    return readers.acquire()
+
+
+def acquire_write():
+    """Take the writer connection. Caller must commit before leaving the block."""
+    return writer.acquire()
+
+
 async def init_db():
-    """Initialize database schema."""
-    db = await get_db()
-    try:
+    """Open the connection pools and initialize database schema."""
+    await writer.open()
+    async with acquire_write() as db:
         await db.executescript(SCHEMA)
         await db.commit()
-    finally:
-        await db.close()
+    # Read-only connections can't create the file, so open them after the schema exists
+    await readers.open()
+
+
+async def close_db():
+    """Close every pooled connection."""
+    await readers.close()
+    await writer.close()
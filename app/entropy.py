@@ -0,0 +1,34 @@
+"""Buffered randomness for IDs and setup passwords."""
+
+import os
+
+
+class EntropyPool:
+    """
+    Hands out slices of one large os.urandom() read instead of making a
+    syscall per token. take() never awaits, so it is safe to share between
+    coroutines on the event loop.
+    """
+
+    def __init__(self, chunk_size: int = 4096):
+        self.chunk_size = chunk_size
+        self._buf = b""
+        self._pos = 0
+
+    def take(self, n: int) -> bytes:
+        if self._pos + n > len(self._buf):
+            self._buf = os.urandom(max(self.chunk_size, n))
+            self._pos = 0
+        out = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return out
+
+    def reset(self):
+        self._buf = b""
+        self._pos = 0
+
+
+entropy = EntropyPool()
+
+# A forked worker must never hand out the same bytes as its parent
+os.register_at_fork(after_in_child=entropy.reset)
@@ -7,18 +7,22 @@ FastAPI application for managing customer OpenClaw instances on Hetzner Cloud.
 import asyncio
 import hashlib
 import hmac
-import json
 import logging
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from typing import Optional
 
+import httpx
+import orjson
+from cachetools import TTLCache
 from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
-from .database import get_db, init_db
+from .database import SQL, acquire_read, acquire_write, close_db, init_db
+from .entropy import entropy
 from .models import (
+    BulkInstanceRequest,
     ErrorResponse,
     HealthResponse,
     InstanceListResponse,
@@ -26,17 +30,37 @@ from .models import (
     ProvisionRequest,
     ProvisionResponse,
 )
-from .provisioner import check_instance_health, provision_instance
+from .provisioner import (
+    check_instance_health,
+    probe_instance_health,
+    provision_instance,
+    record_health_checks,
+    set_health_client,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
 
+# Max health probes in flight at once during /api/health-check-all
+HEALTH_CHECK_CONCURRENCY = 32
+
+# Max Hetzner API calls in flight at once during a bulk suspend/destroy
+BULK_ACTION_CONCURRENCY = 16
+
 
 # ── ID Generation ───────────────────────────────
-def generate_id(prefix: str) -> str:
-    """Generate a short unique ID like 'cust_a1b2c3d4'."""
-    import secrets
-    return f"{prefix}_{secrets.token_hex(6)}"
+_CUST_PREFIX = "cust_"
+_INST_PREFIX = "inst_"
+
+
+def _new_cust_id() -> str:
+    """Generate a short unique customer ID like 'cust_a1b2c3d4e5f6'."""
+    return _CUST_PREFIX + entropy.take(6).hex()
+
+
+def _new_inst_id() -> str:
+    """Generate a short unique instance ID like 'inst_a1b2c3d4e5f6'."""
+    return _INST_PREFIX + entropy.take(6).hex()
 
 
 # ── Auth Dependencies ───────────────────────────
@@ -50,10 +74,30 @@ async def require_admin(x_api_key: str = Header(..., alias="X-API-Key")):
 # ── App Lifecycle ───────────────────────────────
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database on startup."""
+    """Open the database pools and shared HTTP clients on startup, close them on shutdown."""
     await init_db()
     logger.info("Database initialized")
-    yield
+
+    # Long-lived clients keep connections (and TLS sessions) alive between calls
+    app.state.hetzner = httpx.AsyncClient(
+        base_url="https://api.hetzner.cloud/v1",
+        headers={"Authorization": f"Bearer {settings.HETZNER_API_TOKEN}"},
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=32),
+    )
+    app.state.health_http = httpx.AsyncClient(
+        timeout=10,
+        limits=httpx.Limits(max_keepalive_connections=64),
+    )
+    set_health_client(app.state.health_http)
+    try:
+        yield
+    finally:
+        set_health_client(None)
+        await app.state.health_http.aclose()
+        await app.state.hetzner.aclose()
+        await close_db()
 
 
 # ── App Setup ───────────────────────────────────
@@ -97,15 +141,16 @@ async def provision(req: ProvisionRequest, background_tasks: BackgroundTasks):
     Create a new customer + instance and start async provisioning.
     Returns immediately with instance_id; provisioning happens in background.
     """
-    customer_id = generate_id("cust")
-    instance_id = generate_id("inst")
+    customer_id = _new_cust_id()
+    instance_id = _new_inst_id()
+
+    async with acquire_write() as db:
+        # One transaction for all three inserts; IMMEDIATE takes the write lock up front
+        await db.execute(SQL.begin_immediate)
 
-    db = await get_db()
-    try:
         # Create customer
         await db.execute(
-            """INSERT INTO customers (id, email, name, paddle_subscription_id, paddle_customer_id, plan, status)
-            VALUES (?, ?, ?, ?, ?, ?, 'pending')""",
+            SQL.insert_customer,
             (
                 customer_id,
                 req.customer_email,
@@ -117,26 +162,20 @@ async def provision(req: ProvisionRequest, background_tasks: BackgroundTasks):
         )
 
         # Create instance
-        await db.execute(
-            """INSERT INTO instances (id, customer_id, status)
-            VALUES (?, ?, 'provisioning')""",
-            (instance_id, customer_id),
-        )
+        await db.execute(SQL.insert_instance, (instance_id, customer_id))
 
         # Log event
         await db.execute(
-            "INSERT INTO events (instance_id, customer_id, event_type, payload) VALUES (?, ?, ?, ?)",
+            SQL.insert_event,
             (
                 instance_id,
                 customer_id,
                 "provision_requested",
-                json.dumps({"email": req.customer_email, "plan": req.plan}),
+                orjson.dumps({"email": req.customer_email, "plan": req.plan}).decode(),
             ),
         )
 
         await db.commit()
-    finally:
-        await db.close()
 
     # Start provisioning in background
     background_tasks.add_task(provision_instance, instance_id, customer_id)
@@ -162,36 +201,22 @@ async def list_instances(
     offset: int = 0,
 ):
     """List all customer instances, optionally filtered by status."""
-    db = await get_db()
-    try:
-        query = """
-            SELECT i.id as instance_id, i.customer_id, c.email as customer_email,
-                   i.status, i.server_ip, i.hetzner_server_id,
-                   i.setup_password, c.plan, i.created_at,
-                   i.health_status, i.last_health_check
-            FROM instances i
-            JOIN customers c ON i.customer_id = c.id
-        """
-        params = []
-
+    async with acquire_read() as db:
         if status:
-            query += " WHERE i.status = ?"
-            params.append(status)
-
-        query += " ORDER BY i.created_at DESC LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
-
-        cursor = await db.execute(query, params)
+            cursor = await db.execute(SQL.list_instances_by_status, (status, limit, offset))
+        else:
+            cursor = await db.execute(SQL.list_instances, (limit, offset))
         rows = await cursor.fetchall()
-
-        # Count total
-        count_query = "SELECT COUNT(*) FROM instances"
-        if status:
-            count_query += " WHERE status = ?"
-            count_cursor = await db.execute(count_query, [status] if status else [])
+        if rows:
+            total = rows[0]["total"]
+        elif offset > 0:
+            if status:
+                cursor = await db.execute(SQL.count_instances_by_status, (status,))
+            else:
+                cursor = await db.execute(SQL.count_instances)
+            total = (await cursor.fetchone())[0]
         else:
-            count_cursor = await db.execute(count_query)
-        total = (await count_cursor.fetchone())[0]
+            total = 0
 
         instances = []
         for row in rows:
@@ -214,8 +239,6 @@ async def list_instances(
             )
 
         return InstanceListResponse(instances=instances, total=total)
-    finally:
-        await db.close()
 
 
 # ── Health Check ────────────────────────────────
@@ -227,15 +250,9 @@ async def list_instances(
 )
 async def health_check(instance_id: str):
     """Check if a customer's OpenClaw instance is reachable."""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT id, server_ip, health_status, last_health_check, status FROM instances WHERE id = ?",
-            (instance_id,),
-        )
+    async with acquire_read() as db:
+        cursor = await db.execute(SQL.select_instance_health, (instance_id,))
         row = await cursor.fetchone()
-    finally:
-        await db.close()
 
     if not row:
         raise HTTPException(status_code=404, detail="Instance not found")
@@ -261,10 +278,15 @@ async def health_check(instance_id: str):
 
 # ── Paddle Webhook ──────────────────────────────
 
-@app.post("/api/webhook/paddle")
+# event_ids handled in the last minute; Paddle redelivers aggressively
+_recent_webhooks: TTLCache = TTLCache(maxsize=4096, ttl=60)
+
+
+@app.post("/api/webhook/paddle", status_code=202)
 async def paddle_webhook(request: Request, background_tasks: BackgroundTasks):
     """
     Handle Paddle webhook events.
+    Acks as soon as the event is verified; the database work runs after the response.
 
     Events we handle:
     - subscription.created / transaction.completed → provision new instance
@@ -276,14 +298,54 @@ async def paddle_webhook(request: Request, background_tasks: BackgroundTasks):
     # Verify webhook signature (if secret is configured)
     if settings.PADDLE_WEBHOOK_SECRET:
         signature = request.headers.get("paddle-signature", "")
-        if not _verify_paddle_signature(body, signature, settings.PADDLE_WEBHOOK_SECRET):
+        if not _verify_paddle_signature(body, signature):
             raise HTTPException(status_code=401, detail="Invalid webhook signature")
 
     try:
-        payload = json.loads(body)
-    except json.JSONDecodeError:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
+    # Drop redeliveries of an event we just handled before touching the database
+    event_id = payload.get("event_id")
+    if event_id and event_id in _recent_webhooks:
+        logger.info(f"Paddle webhook {event_id} already handled, skipping")
+        return {"status": "duplicate"}
+
+    # Paddle only needs a fast 2xx, so keep SQLite out of the response path
+    background_tasks.add_task(_handle_paddle_event, payload)
+    if event_id:
+        _recent_webhooks[event_id] = True
+    return {"status": "accepted"}
+
+
+async def _handle_paddle_event(payload: dict):
+    """
+    Background task for a verified Paddle event. Paddle has already had its 202
+    and won't redeliver, so a failure is stored as a webhook_failed event with
+    the full payload, which can be replayed to the webhook later.
+    """
+    try:
+        await _apply_paddle_event(payload)
+    except Exception as e:
+        logger.exception(f"Failed to process Paddle webhook {payload.get('event_id')}")
+        # Let a replay of this event through the duplicate check
+        event_id = payload.get("event_id")
+        if event_id:
+            _recent_webhooks.pop(event_id, None)
+        try:
+            async with acquire_write() as db:
+                failure = {"error": repr(e), "payload": payload}
+                await db.execute(
+                    SQL.insert_event, (None, None, "webhook_failed", orjson.dumps(failure).decode())
+                )
+                await db.commit()
+        except Exception:
+            logger.exception(f"Couldn't record failed Paddle webhook; payload: {orjson.dumps(payload).decode()}")
+
+
+async def _apply_paddle_event(payload: dict):
+    """Apply a verified Paddle event to the database."""
     event_type = payload.get("event_type", "")
     data = payload.get("data", {})
 
@@ -307,86 +369,58 @@ async def paddle_webhook(request: Request, background_tasks: BackgroundTasks):
             if billing_cycle is None:
                 plan = "lifetime"
 
-        # Check if already provisioned (idempotency)
-        db = await get_db()
-        try:
-            cursor = await db.execute(
-                "SELECT id FROM customers WHERE paddle_subscription_id = ?",
-                (paddle_sub_id,),
-            )
-            existing = await cursor.fetchone()
-        finally:
-            await db.close()
-
-        if existing:
-            logger.info(f"Subscription {paddle_sub_id} already provisioned, skipping")
-            return {"status": "already_provisioned"}
-
         # Trigger provisioning via the provision endpoint logic
-        customer_id = generate_id("cust")
-        instance_id = generate_id("inst")
+        customer_id = _new_cust_id()
+        instance_id = _new_inst_id()
 
-        db = await get_db()
-        try:
-            await db.execute(
-                """INSERT INTO customers (id, email, paddle_subscription_id, paddle_customer_id, plan, status)
-                VALUES (?, ?, ?, ?, ?, 'pending')""",
-                (customer_id, customer_email, paddle_sub_id, paddle_customer_id, plan),
-            )
-            await db.execute(
-                "INSERT INTO instances (id, customer_id, status) VALUES (?, ?, 'provisioning')",
-                (instance_id, customer_id),
+        async with acquire_write() as db:
+            await db.execute(SQL.begin_immediate)
+            # Idempotency: the UNIQUE subscription id makes a redelivered event insert nothing
+            cursor = await db.execute(
+                SQL.insert_customer_if_new,
+                (customer_id, customer_email, None, paddle_sub_id, paddle_customer_id, plan),
             )
+            created = await cursor.fetchone()
+            await cursor.close()
+            if created is None:
+                await db.rollback()
+                logger.info(f"Subscription {paddle_sub_id} already provisioned, skipping")
+                return
+
+            await db.execute(SQL.insert_instance, (instance_id, customer_id))
             await db.execute(
-                "INSERT INTO events (instance_id, customer_id, event_type, payload) VALUES (?, ?, ?, ?)",
-                (instance_id, customer_id, "paddle_subscription_created", json.dumps(data)),
+                SQL.insert_event,
+                (instance_id, customer_id, "paddle_subscription_created", orjson.dumps(data).decode()),
             )
             await db.commit()
-        finally:
-            await db.close()
 
-        background_tasks.add_task(provision_instance, instance_id, customer_id)
-        return {"status": "provisioning", "instance_id": instance_id}
+        await provision_instance(instance_id, customer_id)
 
     elif event_type == "subscription.canceled":
         paddle_sub_id = data.get("id", "")
-        db = await get_db()
-        try:
-            await db.execute(
-                "UPDATE customers SET status = 'canceled', updated_at = datetime('now') WHERE paddle_subscription_id = ?",
-                (paddle_sub_id,),
-            )
+        async with acquire_write() as db:
+            await db.execute(SQL.update_customer_canceled, (paddle_sub_id,))
             # Get customer to find instance
-            cursor = await db.execute(
-                "SELECT id FROM customers WHERE paddle_subscription_id = ?",
-                (paddle_sub_id,),
-            )
+            cursor = await db.execute(SQL.select_customer_by_sub, (paddle_sub_id,))
             customer = await cursor.fetchone()
             if customer:
                 await db.execute(
-                    "INSERT INTO events (customer_id, event_type, payload) VALUES (?, ?, ?)",
-                    (customer["id"], "subscription_canceled", json.dumps(data)),
+                    SQL.insert_event,
+                    (None, customer["id"], "subscription_canceled", orjson.dumps(data).decode()),
                 )
             await db.commit()
-        finally:
-            await db.close()
 
         logger.info(f"Subscription {paddle_sub_id} canceled — instance will be suspended after grace period")
-        return {"status": "cancellation_noted"}
 
     elif event_type == "subscription.past_due":
         paddle_sub_id = data.get("id", "")
         logger.warning(f"Subscription {paddle_sub_id} is past due!")
-        db = await get_db()
-        try:
+        async with acquire_write() as db:
             await db.execute(
-                "INSERT INTO events (customer_id, event_type, payload) VALUES ((SELECT id FROM customers WHERE paddle_subscription_id = ?), ?, ?)",
-                (paddle_sub_id, "subscription_past_due", json.dumps(data)),
+                SQL.insert_event_by_sub,
+                (paddle_sub_id, "subscription_past_due", orjson.dumps(data).decode()),
             )
             await db.commit()
-        finally:
-            await db.close()
-        return {"status": "past_due_noted"}
 
     elif event_type == "transaction.completed":
         # Could be a one-time lifetime purchase
@@ -396,39 +430,49 @@ async def paddle_webhook(request: Request, background_tasks: BackgroundTasks):
             logger.info("Lifetime purchase detected — would provision here")
             # TODO: implement lifetime provisioning (same flow, different plan tag)
 
-        return {"status": "transaction_noted"}
-
     else:
         logger.info(f"Unhandled Paddle event: {event_type}")
-        return {"status": "ignored", "event_type": event_type}
 
 
-def _verify_paddle_signature(body: bytes, signature_header: str, secret: str) -> bool:
+# Keyed HMAC computed once at import; copy() per request skips the key schedule
+_PADDLE_HMAC_TEMPLATE = (
+    hmac.new(settings.PADDLE_WEBHOOK_SECRET.encode("utf-8"), None, hashlib.sha256)
+    if settings.PADDLE_WEBHOOK_SECRET
+    else None
+)
+
+
+def _verify_paddle_signature(body: bytes, signature_header: str) -> bool:
     """
     Verify Paddle webhook signature.
     See: https://developer.paddle.com/webhooks/signature-verification
     """
-    if not signature_header:
+    if not signature_header or _PADDLE_HMAC_TEMPLATE is None:
         return False
 
     try:
-        # Parse "ts=xxx;h1=xxx" format
-        parts = dict(part.split("=", 1) for part in signature_header.split(";"))
-        ts = parts.get("ts", "")
-        h1 = parts.get("h1", "")
-
-        if not ts or not h1:
+        # Parse "ts=xxx;h1=xxx" format; fields may come in any order, and there
+        # can be several h1 values while the secret is being rotated
+        ts = None
+        signatures = []
+        for field in signature_header.split(";"):
+            key, _, value = field.strip().partition("=")
+            if key == "ts":
+                ts = value
+            elif key == "h1" and value:
+                signatures.append(value)
+
+        if not ts or not signatures:
             return False
 
-        # Build signed payload
-        signed_payload = f"{ts}:{body.decode('utf-8')}"
-        expected = hmac.new(
-            secret.encode("utf-8"),
-            signed_payload.encode("utf-8"),
-            hashlib.sha256,
-        ).hexdigest()
+        # Signed payload is "{ts}:{body}", fed as raw bytes
+        mac = _PADDLE_HMAC_TEMPLATE.copy()
+        mac.update(ts.encode("utf-8"))
+        mac.update(b":")
+        mac.update(body)
 
-        return hmac.compare_digest(expected, h1)
+        expected = mac.hexdigest()
+        return any(hmac.compare_digest(expected, h1) for h1 in signatures)
     except Exception:
         logger.exception("Failed to verify Paddle signature")
         return False
@@ -440,42 +484,26 @@ def _verify_paddle_signature(body: bytes, signature_header: str, secret: str) ->
     "/api/instances/{instance_id}/suspend",
     dependencies=[Depends(require_admin)],
 )
-async def suspend_instance(instance_id: str):
+async def suspend_instance(instance_id: str, request: Request):
     """Suspend (power off) a customer's VPS."""
-    import httpx
-
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT hetzner_server_id, status FROM instances WHERE id = ?",
-            (instance_id,),
-        )
+    async with acquire_read() as db:
+        cursor = await db.execute(SQL.select_instance_server, (instance_id,))
         row = await cursor.fetchone()
-    finally:
-        await db.close()
 
     if not row:
         raise HTTPException(status_code=404, detail="Instance not found")
 
     if row["hetzner_server_id"]:
         # Power off via Hetzner API
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"https://api.hetzner.cloud/v1/servers/{row['hetzner_server_id']}/actions/poweroff",
-                headers={"Authorization": f"Bearer {settings.HETZNER_API_TOKEN}"},
-            )
-            if resp.status_code >= 400:
-                logger.error(f"Failed to power off server: {resp.text}")
-
-    db = await get_db()
-    try:
-        await db.execute(
-            "UPDATE instances SET status = 'suspended', updated_at = datetime('now') WHERE id = ?",
-            (instance_id,),
+        resp = await request.app.state.hetzner.post(
+            f"/servers/{row['hetzner_server_id']}/actions/poweroff"
         )
+        if resp.status_code >= 400:
+            logger.error(f"Failed to power off server: {resp.text}")
+
+    async with acquire_write() as db:
+        await db.execute(SQL.update_instance_status, ("suspended", instance_id))
         await db.commit()
-    finally:
-        await db.close()
 
     return {"status": "suspended", "instance_id": instance_id}
 
@@ -484,46 +512,106 @@ async def suspend_instance(instance_id: str):
     "/api/instances/{instance_id}/destroy",
     dependencies=[Depends(require_admin)],
 )
-async def destroy_instance(instance_id: str):
+async def destroy_instance(instance_id: str, request: Request):
     """Destroy a customer's VPS (permanent, deletes server)."""
-    import httpx
-
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT hetzner_server_id FROM instances WHERE id = ?",
-            (instance_id,),
-        )
+    async with acquire_read() as db:
+        cursor = await db.execute(SQL.select_instance_server, (instance_id,))
         row = await cursor.fetchone()
-    finally:
-        await db.close()
 
     if not row:
         raise HTTPException(status_code=404, detail="Instance not found")
 
     if row["hetzner_server_id"]:
         # Delete via Hetzner API
-        async with httpx.AsyncClient() as client:
-            resp = await client.delete(
-                f"https://api.hetzner.cloud/v1/servers/{row['hetzner_server_id']}",
-                headers={"Authorization": f"Bearer {settings.HETZNER_API_TOKEN}"},
-            )
-            if resp.status_code >= 400:
-                logger.error(f"Failed to delete server: {resp.text}")
+        resp = await request.app.state.hetzner.delete(f"/servers/{row['hetzner_server_id']}")
+        if resp.status_code >= 400:
+            logger.error(f"Failed to delete server: {resp.text}")
 
-    db = await get_db()
-    try:
-        await db.execute(
-            "UPDATE instances SET status = 'destroyed', updated_at = datetime('now') WHERE id = ?",
-            (instance_id,),
-        )
+    async with acquire_write() as db:
+        await db.execute(SQL.update_instance_status, ("destroyed", instance_id))
         await db.commit()
-    finally:
-        await db.close()
 
     return {"status": "destroyed", "instance_id": instance_id}
 
 
+@app.post(
+    "/api/instances/bulk-suspend",
+    dependencies=[Depends(require_admin)],
+)
+async def bulk_suspend_instances(req: BulkInstanceRequest, request: Request):
+    """Suspend (power off) many customer VPSes at once."""
+    return await _bulk_server_action(
+        request,
+        req.instance_ids,
+        lambda hetzner, server_id: hetzner.post(f"/servers/{server_id}/actions/poweroff"),
+        "suspended",
+    )
+
+
+@app.post(
+    "/api/instances/bulk-destroy",
+    dependencies=[Depends(require_admin)],
+)
+async def bulk_destroy_instances(req: BulkInstanceRequest, request: Request):
+    """Destroy many customer VPSes at once (permanent, deletes servers)."""
+    return await _bulk_server_action(
+        request,
+        req.instance_ids,
+        lambda hetzner, server_id: hetzner.delete(f"/servers/{server_id}"),
+        "destroyed",
+    )
+
+
+async def _bulk_server_action(request: Request, instance_ids: list[str], send, new_status: str) -> dict:
+    """
+    Look up all servers in one query, fire the Hetzner calls concurrently over
+    the shared HTTP/2 client, then update every instance in one transaction.
+    """
+    async with acquire_read() as db:
+        cursor = await db.execute(
+            SQL.select_instances_servers, (orjson.dumps(instance_ids).decode(),)
+        )
+        servers = {row["id"]: row["hetzner_server_id"] for row in await cursor.fetchall()}
+
+    sem = asyncio.Semaphore(BULK_ACTION_CONCURRENCY)
+
+    async def call(server_id):
+        async with sem:
+            return await send(request.app.state.hetzner, server_id)
+
+    targets = [(instance_id, server_id) for instance_id, server_id in servers.items() if server_id]
+    responses = await asyncio.gather(
+        *(call(server_id) for _, server_id in targets),
+        return_exceptions=True,
+    )
+
+    # An instance's status only changes if its server call went through
+    failed = []
+    for (instance_id, server_id), resp in zip(targets, responses):
+        if isinstance(resp, Exception):
+            logger.error(f"Hetzner call for server {server_id} ({instance_id}) failed: {resp!r}")
+            failed.append(instance_id)
+        elif resp.status_code >= 400:
+            logger.error(f"Hetzner call for server {server_id} ({instance_id}) failed: {resp.text}")
+            failed.append(instance_id)
+    updated = [instance_id for instance_id in servers if instance_id not in failed]
+
+    if updated:
+        async with acquire_write() as db:
+            await db.execute(SQL.begin_immediate)
+            await db.executemany(
+                SQL.update_instance_status, [(new_status, instance_id) for instance_id in updated]
+            )
+            await db.commit()
+
+    return {
+        "status": new_status,
+        "instance_ids": updated,
+        "failed": failed,
+        "not_found": [i for i in instance_ids if i not in servers],
+    }
+
+
 # ── Health Check All (for cron) ─────────────────
 
 @app.post(
@@ -535,19 +623,22 @@ async def health_check_all():
     Run health checks on all active instances.
     Call this from a cron job every 5 minutes.
     """
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT id, server_ip FROM instances WHERE status = 'active' AND server_ip IS NOT NULL"
-        )
+    async with acquire_read() as db:
+        cursor = await db.execute(SQL.select_active_instances)
         rows = await cursor.fetchall()
-    finally:
-        await db.close()
 
-    results = {}
-    for row in rows:
-        is_healthy = await check_instance_health(row["id"], row["server_ip"])
-        results[row["id"]] = "healthy" if is_healthy else "unhealthy"
+    sem = asyncio.Semaphore(HEALTH_CHECK_CONCURRENCY)
+
+    async def probe(row):
+        async with sem:
+            return row["id"], await probe_instance_health(row["server_ip"])
+
+    # Probe concurrently, then write every result in one transaction
+    checks = dict(await asyncio.gather(*(probe(row) for row in rows)))
+    if checks:
+        await record_health_checks(checks)
+
+    results = {k: "healthy" if v else "unhealthy" for k, v in checks.items()}
 
     unhealthy = [k for k, v in results.items() if v == "unhealthy"]
     if unhealthy:
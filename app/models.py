@@ -1,6 +1,6 @@
 """Pydantic models for request/response validation."""
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, Literal
 from datetime import datetime
 
@@ -15,6 +15,10 @@ class ProvisionRequest(BaseModel):
     plan: Literal["monthly", "lifetime"]
 
 
+class BulkInstanceRequest(BaseModel):
+    instance_ids: list[str] = Field(min_length=1, max_length=500)
+
+
 # ── Response Models ─────────────────────────────
 
 class ProvisionResponse(BaseModel):
@@ -1,34 +1,55 @@
 """Async provisioning logic — runs provisioning.sh as a subprocess."""
 
 import asyncio
+import base64
 import json
 import logging
-import secrets
+import os
+import signal
+from collections import deque
 from datetime import datetime, timezone
+from typing import Optional
+
+import aiofiles
+import httpx
+import orjson
 
 from .config import settings
-from .database import get_db
+from .database import SQL, acquire_write
+from .entropy import entropy
 
 logger = logging.getLogger(__name__)
 
+# Only the last N lines of each provisioning.sh stream are kept in memory, each
+# clipped to TAIL_LINE_MAX_CHARS; the complete output goes to PROVISION_LOG_DIR,
+# and SQLite gets a shorter tail
+LOG_TAIL_LINES = 2000
+TAIL_LINE_MAX_CHARS = 4096
+DB_LOG_TAIL_LINES = 200
+DB_LOG_TAIL_BYTES = 32 * 1024  # per stream
+
+# Shared client for gateway probes, owned by the app lifespan (see main.py)
+_health_http: Optional[httpx.AsyncClient] = None
+
+
+def set_health_client(client: Optional[httpx.AsyncClient]):
+    """Install (or clear) the shared HTTP client used for health probes."""
+    global _health_http
+    _health_http = client
+
 
 async def provision_instance(instance_id: str, customer_id: str):
     """
     Run provisioning.sh in the background for a given instance.
     Updates the database with results.
     """
-    setup_password = secrets.token_urlsafe(24)
+    # Same shape as secrets.token_urlsafe(24): 24 random bytes, unpadded base64url
+    setup_password = base64.urlsafe_b64encode(entropy.take(24)).rstrip(b"=").decode()
 
     # Store the setup password
-    db = await get_db()
-    try:
-        await db.execute(
-            "UPDATE instances SET setup_password = ?, updated_at = datetime('now') WHERE id = ?",
-            (setup_password, instance_id),
-        )
+    async with acquire_write() as db:
+        await db.execute(SQL.update_setup_password, (setup_password, instance_id))
         await db.commit()
-    finally:
-        await db.close()
 
     logger.info(f"Starting provisioning for instance {instance_id} (customer {customer_id})")
 
@@ -50,138 +71,260 @@ async def provision_instance(instance_id: str, customer_id: str):
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             env=env,
+            limit=1024 * 1024,  # max line length for the stream readers
+            start_new_session=True,  # own process group, so a kill reaches its children too
         )
 
-        stdout, stderr = await asyncio.wait_for(
-            process.communicate(),
-            timeout=600,  # 10 minute timeout
+        stdout_tail: deque[str] = deque(maxlen=LOG_TAIL_LINES)
+        stderr_tail: deque[str] = deque(maxlen=LOG_TAIL_LINES)
+        log_file = await _open_full_log(instance_id)
+        readers = [
+            asyncio.ensure_future(_drain(process.stdout, stdout_tail, log_file)),
+            asyncio.ensure_future(_drain(process.stderr, stderr_tail, log_file)),
+            asyncio.ensure_future(process.wait()),
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*readers), timeout=600)  # 10 minute timeout
+        finally:
+            # On any failure, don't leave the script running (it may still create a
+            # server after we've marked the instance failed) or its readers pending
+            for task in readers:
+                task.cancel()
+            if process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+            await asyncio.gather(*readers, return_exceptions=True)
+            if log_file is not None:
+                try:
+                    await log_file.close()
+                except OSError:
+                    logger.warning(f"Couldn't finish provisioning log for {instance_id}")
+
+        stdout_text = "\n".join(stdout_tail)
+        log_tail = "STDOUT:\n{}\n\nSTDERR:\n{}".format(
+            _db_tail(stdout_tail), _db_tail(stderr_tail)
         )
 
-        stdout_text = stdout.decode("utf-8", errors="replace")
-        stderr_text = stderr.decode("utf-8", errors="replace")
-        full_log = f"STDOUT:\n{stdout_text}\n\nSTDERR:\n{stderr_text}"
+        result = _parse_result(stdout_text) if process.returncode == 0 else None
 
-        db = await get_db()
-        try:
+        async with acquire_write() as db:
+            # Take the write lock up front; all three statements land in one commit
+            await db.execute(SQL.begin_immediate)
             if process.returncode == 0:
-                # Parse JSON output from stdout (last line that looks like JSON)
-                result = None
-                for line in stdout_text.strip().split("\n"):
-                    line = line.strip()
-                    if line.startswith("{"):
-                        try:
-                            result = json.loads(line)
-                        except json.JSONDecodeError:
-                            continue
-
                 if result and result.get("status") == "success":
                     await db.execute(
-                        """UPDATE instances SET
-                            status = 'active',
-                            hetzner_server_id = ?,
-                            server_ip = ?,
-                            server_name = ?,
-                            setup_password = ?,
-                            health_status = 'healthy',
-                            last_health_check = datetime('now'),
-                            provision_log = ?,
-                            updated_at = datetime('now')
-                        WHERE id = ?""",
+                        SQL.update_instance_provisioned,
                         (
                             result.get("server_id"),
                             result.get("server_ip"),
                             result.get("server_name"),
                             result.get("setup_password", setup_password),
-                            full_log,
                             instance_id,
                         ),
                     )
-                    await db.execute(
-                        "UPDATE customers SET status = 'active', updated_at = datetime('now') WHERE id = ?",
-                        (customer_id,),
-                    )
+                    await db.execute(SQL.upsert_instance_log, (instance_id, log_tail))
+                    await db.execute(SQL.update_customer_active, (customer_id,))
 
                     # Log event
                     await db.execute(
-                        "INSERT INTO events (instance_id, customer_id, event_type, payload) VALUES (?, ?, ?, ?)",
-                        (instance_id, customer_id, "provisioned", json.dumps(result)),
+                        SQL.insert_event,
+                        (instance_id, customer_id, "provisioned", orjson.dumps(result).decode()),
                     )
                     logger.info(
                         f"✅ Instance {instance_id} provisioned successfully: {result.get('server_ip')}"
                     )
                 else:
                     # Script returned 0 but output wasn't valid
-                    await _mark_failed(db, instance_id, customer_id, full_log)
+                    await _mark_failed(db, instance_id, customer_id, log_tail)
                     logger.error(f"Provisioning returned 0 but invalid output for {instance_id}")
             else:
-                await _mark_failed(db, instance_id, customer_id, full_log)
+                await _mark_failed(db, instance_id, customer_id, log_tail)
                 logger.error(
                     f"Provisioning failed for {instance_id} (exit code {process.returncode})"
                 )
 
             await db.commit()
-        finally:
-            await db.close()
 
     except asyncio.TimeoutError:
         logger.error(f"Provisioning timed out for {instance_id}")
-        db = await get_db()
-        try:
+        async with acquire_write() as db:
             await _mark_failed(db, instance_id, customer_id, "Provisioning timed out after 600s")
             await db.commit()
-        finally:
-            await db.close()
 
     except Exception as e:
         logger.exception(f"Unexpected error provisioning {instance_id}")
-        db = await get_db()
-        try:
+        async with acquire_write() as db:
             await _mark_failed(db, instance_id, customer_id, str(e))
             await db.commit()
-        finally:
-            await db.close()
+
+
+def _private_opener(path: str, flags: int) -> int:
+    """
+    os.open for provisioning logs: they contain the setup password, so the
+    file is always 0600 and a directory we create is 0700. An existing
+    directory is operator-chosen and may be shared, so it's only warned about.
+    """
+    log_dir = os.path.dirname(path)
+    try:
+        os.makedirs(log_dir, mode=0o700)
+    except FileExistsError:
+        if os.stat(log_dir).st_mode & 0o077:
+            logger.warning(f"Provisioning log directory {log_dir} is accessible to other users")
+    fd = os.open(path, flags, 0o600)
+    os.fchmod(fd, 0o600)
+    return fd
+
+
+async def _open_full_log(instance_id: str):
+    """Open the on-disk log for a provisioning run, or None if it can't be created."""
+    try:
+        return await aiofiles.open(
+            os.path.join(settings.PROVISION_LOG_DIR, f"{instance_id}.log"),
+            "w",
+            encoding="utf-8",
+            opener=_private_opener,
+        )
+    except OSError:
+        logger.warning(f"Can't write provisioning log for {instance_id} to {settings.PROVISION_LOG_DIR}")
+        return None
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque, log_file=None):
+    """
+    Read a subprocess pipe line by line into the bounded `tail`, copying
+    every line to `log_file` (both pipes share it, like `2>&1`). A line longer
+    than the reader limit is cut at the limit rather than failing the run, and
+    if the file can't be written the tail is still kept. Lines in `tail` are
+    clipped to TAIL_LINE_MAX_CHARS; the file gets them whole.
+    """
+    async def emit(raw: bytes, suffix: str = ""):
+        nonlocal log_file
+        line = raw.decode("utf-8", errors="replace").rstrip() + suffix
+        if len(line) > TAIL_LINE_MAX_CHARS:
+            tail.append(line[:TAIL_LINE_MAX_CHARS] + " [clipped]")
+        else:
+            tail.append(line)
+        if log_file is not None:
+            try:
+                await log_file.write(line + "\n")
+            except OSError as e:
+                logger.warning(f"Stopped writing provisioning log {log_file.name}: {e}")
+                log_file = None
+
+    truncating = False
+    while True:
+        try:
+            raw = await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            # EOF: whatever is left is the last line, without its newline
+            raw = e.partial
+            if not raw:
+                return
+        except asyncio.LimitOverrunError as e:
+            # Keep the first chunk of an over-long line and skip to its newline
+            raw = await stream.read(e.consumed)
+            if not truncating:
+                truncating = True
+                await emit(raw, " [truncated]")
+            continue
+        if truncating:
+            # Rest of the line that was just cut
+            truncating = False
+            continue
+        await emit(raw)
+
+
+def _db_tail(lines: deque) -> str:
+    """
+    The end of a stream for SQLite: at most DB_LOG_TAIL_LINES lines and
+    DB_LOG_TAIL_BYTES of UTF-8, oldest first. A single last line that is bigger
+    than the budget is cut from the front.
+    """
+    kept = []
+    budget = DB_LOG_TAIL_BYTES
+    for line in reversed(lines):
+        if len(kept) == DB_LOG_TAIL_LINES:
+            break
+        size = len(line.encode("utf-8")) + 1
+        if size > budget:
+            if not kept:
+                kept.append(line.encode("utf-8")[-budget:].decode("utf-8", errors="ignore"))
+            break
+        kept.append(line)
+        budget -= size
+    return "\n".join(reversed(kept))
+
+
+# raw_decode stops at the end of the first JSON value, ignoring whatever follows it
+_json_decoder = json.JSONDecoder()
+
+
+def _parse_result(stdout_text: str) -> Optional[dict]:
+    """
+    Find the last JSON object provisioning.sh printed. jq pretty-prints it
+    over several lines, so search backwards for a line that opens an object
+    and decode from there; normally the first candidate parses.
+    """
+    end = len(stdout_text)
+    while True:
+        idx = stdout_text.rfind("\n{", 0, end)
+        start = idx + 1
+        if idx >= 0 or stdout_text.startswith("{"):
+            try:
+                result, _ = _json_decoder.raw_decode(stdout_text, start)
+                if isinstance(result, dict):
+                    return result
+            except json.JSONDecodeError:
+                pass
+        if idx < 0:
+            return None
+        end = idx
 
 
 async def _mark_failed(db, instance_id: str, customer_id: str, log: str):
     """Mark an instance as failed."""
+    await db.execute(SQL.update_instance_failed, (instance_id,))
+    await db.execute(SQL.upsert_instance_log, (instance_id, log))
     await db.execute(
-        """UPDATE instances SET
-            status = 'failed',
-            provision_log = ?,
-            updated_at = datetime('now')
-        WHERE id = ?""",
-        (log, instance_id),
+        SQL.insert_event,
+        (instance_id, customer_id, "provision_failed", orjson.dumps({"log_preview": log[:500]}).decode()),
     )
-    await db.execute(
-        "INSERT INTO events (instance_id, customer_id, event_type, payload) VALUES (?, ?, ?, ?)",
-        (instance_id, customer_id, "provision_failed", json.dumps({"log_preview": log[:500]})),
-    )
-
 
-async def check_instance_health(instance_id: str, server_ip: str) -> bool:
-    """Check if an instance's OpenClaw gateway is reachable."""
-    import httpx
 
+async def probe_instance_health(server_ip: str) -> bool:
+    """Check if an instance's OpenClaw gateway is reachable. Doesn't touch the database."""
+    if _health_http is None:
+        # Outside the app lifespan; don't let this read as every gateway being down
+        raise RuntimeError("No health-check HTTP client installed (see set_health_client)")
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.get(f"http://{server_ip}:18789/")
-            is_healthy = 200 <= resp.status_code < 500
+        resp = await _health_http.get(f"http://{server_ip}:18789/")
+        return 200 <= resp.status_code < 500
     except Exception:
-        is_healthy = False
+        return False
 
-    db = await get_db()
-    try:
-        health_status = "healthy" if is_healthy else "unhealthy"
-        await db.execute(
-            """UPDATE instances SET
-                health_status = ?,
-                last_health_check = datetime('now'),
-                updated_at = datetime('now')
-            WHERE id = ?""",
-            (health_status, instance_id),
+
+async def record_health_checks(results: dict[str, bool]):
+    """Store health check results for many instances in a single transaction."""
+    async with acquire_write() as db:
+        await db.execute(SQL.begin_immediate)
+        await db.executemany(
+            SQL.update_instance_health,
+            [
+                ("healthy" if is_healthy else "unhealthy", instance_id)
+                for instance_id, is_healthy in results.items()
+            ],
         )
         await db.commit()
-    finally:
-        await db.close()
 
+
+async def check_instance_health(instance_id: str, server_ip: str) -> bool:
+    """
+    Check if an instance's OpenClaw gateway is reachable and record the result.
+    The probe runs with no connection held; the writer is only taken for the UPDATE.
+    """
+    is_healthy = await probe_instance_health(server_ip)
+    await record_health_checks({instance_id: is_healthy})
     return is_healthy